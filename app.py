@@ -7,11 +7,18 @@ between peers for voice, video, and screen sharing.
 Hosted on Render.com - always online for your friends to connect.
 """
 
-from flask import Flask, request
-from flask_socketio import SocketIO, emit, join_room, leave_room
+# Eventlet must patch the standard library before anything else imports it
+import eventlet
+eventlet.monkey_patch()
+
+from flask import Flask, Response, request
+from flask_socketio import SocketIO, emit, join_room, leave_room, close_room
 from flask_cors import CORS
 import os
 import logging
+import orjson
+import time
+from collections import defaultdict
 from datetime import datetime
 
 # Configure logging
@@ -21,6 +28,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+class OrjsonCodec:
+    """
+    Expose orjson through the stdlib json dumps/loads interface so
+    Socket.IO can use it to encode and decode every packet.
+    """
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        # Socket.IO passes stdlib-only options such as separators; orjson
+        # already emits compact output, so they are ignored
+        return orjson.dumps(obj).decode('utf-8')
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return orjson.loads(s)
+
+
 # Initialize Flask app
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'yumee-secret-key-change-in-production')
@@ -28,40 +53,99 @@ app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'yumee-secret-key-change
 # Enable CORS for all origins (needed for WebSocket connections)
 CORS(app, resources={r"/*": {"origins": "*"}})
 
-# Initialize SocketIO with gevent for production (works with Gunicorn)
+# Initialize SocketIO with eventlet for production (works with Gunicorn).
+# A single eventlet worker multiplexes every connection over native WebSocket
+# transport instead of a thread (and long-polling fallback) per client.
+# User and room state below lives in this process, so run exactly one worker.
 socketio = SocketIO(
     app,
     cors_allowed_origins="*",
-    async_mode='threading',
+    async_mode='eventlet',
     logger=False,
     engineio_logger=False,
     ping_timeout=60,
     ping_interval=25,
-    manage_session=False
+    json=OrjsonCodec
 )
 
-# Store connected users: {socket_id: {"name": display_name, "sid": socket_id}}
+# Store connected users: {socket_id: display_name}
 connected_users = {}
 
-# Store room information for calls: {room_id: [user1_sid, user2_sid]}
+# Store room information for calls: {room_id: (caller_sid, target_sid)}
 active_rooms = {}
 
+# Reverse index of call rooms per user: {socket_id: {room_id, ...}}
+user_rooms = {}
+
+# user_list entries maintained incrementally alongside connected_users:
+# [{"name": display_name, "sid": socket_id}, ...] plus {socket_id: index}
+_user_list_shadow = []
+_user_index = {}
+
+# Presence changes waiting to be flushed as one presence_delta event:
+# {socket_id: display_name}
+_pending_joins = {}
+_pending_leaves = {}
+_pending_renames = {}
+_presence_flush_scheduled = False
+
+# Room joined by every registered user; presence and public chat go here
+LOBBY_ROOM = 'lobby'
+
+# How long (seconds) to coalesce joins/leaves before notifying everyone
+PRESENCE_BATCH_WINDOW = 0.05
+
+# ICE candidates waiting to be relayed as one batch, per sender/target pair:
+# {(sender_sid, target_sid): [candidate, ...]}
+_ice_buffers = defaultdict(list)
+
+# How long (seconds) to collect ICE candidates per target before relaying
+ICE_BATCH_WINDOW = 0.01
+
+# Cached JSON bodies for the status endpoints:
+# {endpoint: (body_bytes, built_at, user_count)}
+_status_cache = {}
+
+# How long (seconds) a status body is reused while the user count is unchanged
+STATUS_CACHE_TTL = 1.0
+
+
+def cached_status_response(endpoint, build):
+    """
+    Serve a pre-encoded JSON body for a status endpoint.
+    The body is rebuilt with build() when the user count changes or after
+    STATUS_CACHE_TTL seconds, so monitoring pings reuse the same bytes.
+    """
+    now = time.monotonic()
+    user_count = len(connected_users)
+    cached = _status_cache.get(endpoint)
+    
+    if (cached is None or cached[2] != user_count
+            or now - cached[1] >= STATUS_CACHE_TTL):
+        cached = (orjson.dumps(build()), now, user_count)
+        _status_cache[endpoint] = cached
+    
+    return Response(cached[0], mimetype='application/json')
+
 
 @app.route('/')
 def index():
     """Health check endpoint."""
-    return {
+    return cached_status_response('index', lambda: {
         "status": "online",
         "service": "Yumee Signaling Server",
         "connected_users": len(connected_users),
         "timestamp": datetime.utcnow().isoformat()
-    }
+    })
 
 
 @app.route('/health')
 def health():
     """Simple health check for monitoring."""
-    return {"status": "healthy", "users_online": len(connected_users)}
+    return cached_status_response('health', lambda: {
+        "status": "healthy",
+        "users_online": len(connected_users)
+    })
 
 
 # ==================== SOCKET EVENT HANDLERS ====================
@@ -69,7 +153,7 @@ def health():
 @socketio.on('connect')
 def handle_connect():
     """Handle new client connection."""
-    logger.info(f"Client connected: {request.sid}")
+    logger.info("Client connected: %s", request.sid)
     emit('connected', {'sid': request.sid, 'message': 'Connected to Yumee server'})
 
 
@@ -77,23 +161,19 @@ def handle_connect():
 def handle_disconnect():
     """Handle client disconnection - cleanup user from lists."""
     sid = request.sid
-    logger.info(f"Client disconnected: {sid}")
+    logger.info("Client disconnected: %s", sid)
     
     if sid in connected_users:
-        user_name = connected_users[sid]['name']
+        user_name = connected_users[sid]
         del connected_users[sid]
+        remove_from_user_list(sid)
+        leave_room(LOBBY_ROOM, sid=sid)
         
-        # Notify all other users that someone left
-        emit('user_left', {
-            'name': user_name,
-            'sid': sid
-        }, broadcast=True, include_self=False)
-        
-        # Update everyone's user list
-        broadcast_user_list()
+        # Notify everyone (batched) that someone left
+        queue_presence_leave(sid, user_name)
         
         # Clean up any rooms this user was in
-        cleanup_user_rooms(sid)
+        cleanup_user_rooms(sid, user_name)
 
 
 @socketio.on('register')
@@ -103,22 +183,25 @@ def handle_register(data):
     Called when client first connects with their chosen name.
     """
     try:
-        display_name = data.get('name', 'Anonymous').strip()
+        # Check the raw length before stripping so huge names are never scanned
+        display_name = data.get('name') or 'Anonymous'
+        if len(display_name) > 1024:
+            display_name = 'Anonymous'
+        display_name = display_name.strip()
         
         # Validate name
         if not display_name or len(display_name) > 30:
             display_name = 'Anonymous'
         
         sid = request.sid
+        is_new_user = sid not in connected_users
         
-        # Store user info
-        connected_users[sid] = {
-            'name': display_name,
-            'sid': sid,
-            'joined_at': datetime.utcnow().isoformat()
-        }
+        # Store user name (the sid is already the key)
+        connected_users[sid] = display_name
+        add_to_user_list(sid, display_name)
+        join_room(LOBBY_ROOM, sid=sid)
         
-        logger.info(f"User registered: {display_name} ({sid})")
+        logger.info("User registered: %s (%s)", display_name, sid)
         
         # Confirm registration to the user
         emit('registered', {
@@ -127,17 +210,16 @@ def handle_register(data):
             'sid': sid
         })
         
-        # Notify others that a new user joined
-        emit('user_joined', {
-            'name': display_name,
-            'sid': sid
-        }, broadcast=True, include_self=False)
-        
-        # Send the complete user list to the newly connected client
-        broadcast_user_list()
+        # Notify everyone (batched) that a new user joined, along with
+        # the complete user list for the newly connected client; a repeat
+        # registration is a rename, not a second join
+        if is_new_user:
+            queue_presence_join(sid, display_name)
+        else:
+            queue_presence_rename(sid, display_name)
         
     except Exception as e:
-        logger.error(f"Error in register: {e}")
+        logger.error("Error in register: %s", e)
         emit('registered', {'success': False, 'error': str(e)})
 
 
@@ -147,22 +229,104 @@ def handle_get_users():
     broadcast_user_list(to_sid=request.sid)
 
 
-def broadcast_user_list(to_sid=None):
+def add_to_user_list(sid, name):
+    """Add a user to the shadow user list, or rename them if already listed."""
+    index = _user_index.get(sid)
+    if index is None:
+        _user_index[sid] = len(_user_list_shadow)
+        _user_list_shadow.append({'name': name, 'sid': sid})
+    else:
+        _user_list_shadow[index] = {'name': name, 'sid': sid}
+
+
+def remove_from_user_list(sid):
     """
-    Broadcast the list of connected users.
-    If to_sid is provided, only send to that user. Otherwise broadcast to all.
+    Remove a user from the shadow user list in O(1) by moving the last
+    entry into the vacated slot.
     """
-    user_list = [
-        {'name': info['name'], 'sid': sid}
-        for sid, info in connected_users.items()
-    ]
+    index = _user_index.pop(sid, None)
+    if index is None:
+        return
     
-    payload = {'users': user_list}
-    
-    if to_sid:
-        emit('user_list', payload, room=to_sid)
+    last = _user_list_shadow.pop()
+    if index < len(_user_list_shadow):
+        _user_list_shadow[index] = last
+        _user_index[last['sid']] = index
+
+
+def get_user_list_payload():
+    """Return the user_list payload backed by the shadow user list."""
+    return {'users': _user_list_shadow}
+
+
+def broadcast_user_list(to_sid):
+    """
+    Send the list of connected users to to_sid.
+    Everyone else is kept up to date through presence_delta.
+    """
+    emit('user_list', get_user_list_payload(), room=to_sid)
+
+
+def queue_presence_join(sid, name):
+    """Queue a user_joined notification for the next presence_delta."""
+    _pending_joins[sid] = name
+    schedule_presence_flush()
+
+
+def queue_presence_rename(sid, name):
+    """
+    Queue a rename of an already registered user for the next presence_delta.
+    A user still waiting to be announced is simply announced with the new name.
+    """
+    if sid in _pending_joins:
+        _pending_joins[sid] = name
     else:
-        emit('user_list', payload, broadcast=True)
+        _pending_renames[sid] = name
+    schedule_presence_flush()
+
+
+def queue_presence_leave(sid, name):
+    """
+    Queue a user_left notification for the next presence_delta.
+    A user who joins and leaves within the same window is never announced.
+    """
+    _pending_renames.pop(sid, None)
+    if _pending_joins.pop(sid, None) is None:
+        _pending_leaves[sid] = name
+    schedule_presence_flush()
+
+
+def schedule_presence_flush():
+    """Start the background flush task unless one is already waiting."""
+    global _presence_flush_scheduled
+    
+    if not _presence_flush_scheduled:
+        _presence_flush_scheduled = True
+        socketio.start_background_task(flush_presence)
+
+
+def flush_presence():
+    """
+    Wait for the batch window, then send every queued join/leave/rename
+    together with the current user list as a single presence_delta to the lobby.
+    """
+    global _pending_joins, _pending_leaves, _pending_renames, _presence_flush_scheduled
+    
+    socketio.sleep(PRESENCE_BATCH_WINDOW)
+    
+    joins, leaves, renames = _pending_joins, _pending_leaves, _pending_renames
+    _pending_joins, _pending_leaves, _pending_renames = {}, {}, {}
+    _presence_flush_scheduled = False
+    
+    if not joins and not leaves and not renames:
+        return
+    
+    socketio.emit('presence_delta', {
+        'joined': [{'name': name, 'sid': sid} for sid, name in joins.items()],
+        'left': [{'name': name, 'sid': sid} for sid, name in leaves.items()],
+        'renamed': [{'name': name, 'sid': sid} for sid, name in renames.items()],
+        'users': get_user_list_payload()['users']
+    }, room=LOBBY_ROOM)
 
 
 # ==================== WEBRTC SIGNALING ====================
@@ -185,19 +349,22 @@ def handle_call_user(data):
             emit('call_error', {'error': 'Cannot call yourself'})
             return
         
-        # Create a unique room ID
-        room_id = f"call_{min(caller_sid, target_sid)}_{max(caller_sid, target_sid)}"
+        # Create a unique room ID (same pair of users -> same room)
+        first_sid, second_sid = sorted((caller_sid, target_sid))
+        room_id = f"call_{first_sid}_{second_sid}"
         
         # Join both users to the room
         join_room(room_id, sid=caller_sid)
         join_room(room_id, sid=target_sid)
         
-        active_rooms[room_id] = [caller_sid, target_sid]
+        active_rooms[room_id] = (caller_sid, target_sid)
+        user_rooms.setdefault(caller_sid, set()).add(room_id)
+        user_rooms.setdefault(target_sid, set()).add(room_id)
         
-        caller_name = connected_users[caller_sid]['name']
-        target_name = connected_users[target_sid]['name']
+        caller_name = connected_users[caller_sid]
+        target_name = connected_users[target_sid]
         
-        logger.info(f"Call initiated: {caller_name} -> {target_name}, room: {room_id}")
+        logger.info("Call initiated: %s -> %s, room: %s", caller_name, target_name, room_id)
         
         # Notify the target user about incoming call
         emit('incoming_call', {
@@ -214,7 +381,7 @@ def handle_call_user(data):
         })
         
     except Exception as e:
-        logger.error(f"Error in call_user: {e}")
+        logger.error("Error in call_user: %s", e)
         emit('call_error', {'error': str(e)})
 
 
@@ -229,13 +396,9 @@ def handle_accept_call(data):
             emit('call_error', {'error': 'Call no longer exists'})
             return
         
-        # Find the caller (the other person in the room)
-        room_users = active_rooms[room_id]
-        caller_sid = [u for u in room_users if u != accepter_sid][0]
-        
-        accepter_name = connected_users[accepter_sid]['name']
+        accepter_name = connected_users[accepter_sid]
         
-        logger.info(f"Call accepted by {accepter_name}")
+        logger.info("Call accepted by %s", accepter_name)
         
         # Notify both users that call is connected
         emit('call_accepted', {
@@ -245,7 +408,7 @@ def handle_accept_call(data):
         }, room=room_id)
         
     except Exception as e:
-        logger.error(f"Error in accept_call: {e}")
+        logger.error("Error in accept_call: %s", e)
         emit('call_error', {'error': str(e)})
 
 
@@ -257,12 +420,12 @@ def handle_reject_call(data):
         rejecter_sid = request.sid
         
         if room_id in active_rooms:
-            room_users = active_rooms[room_id]
-            caller_sid = [u for u in room_users if u != rejecter_sid][0]
+            first_sid, second_sid = active_rooms[room_id]
+            caller_sid = second_sid if first_sid == rejecter_sid else first_sid
             
-            rejecter_name = connected_users[rejecter_sid]['name']
+            rejecter_name = connected_users[rejecter_sid]
             
-            logger.info(f"Call rejected by {rejecter_name}")
+            logger.info("Call rejected by %s", rejecter_name)
             
             # Notify the caller
             emit('call_rejected', {
@@ -273,7 +436,7 @@ def handle_reject_call(data):
             cleanup_room(room_id)
             
     except Exception as e:
-        logger.error(f"Error in reject_call: {e}")
+        logger.error("Error in reject_call: %s", e)
 
 
 @socketio.on('end_call')
@@ -284,9 +447,9 @@ def handle_end_call(data):
         ender_sid = request.sid
         
         if room_id in active_rooms:
-            ender_name = connected_users.get(ender_sid, {}).get('name', 'Someone')
+            ender_name = connected_users.get(ender_sid, 'Someone')
             
-            logger.info(f"Call ended by {ender_name}")
+            logger.info("Call ended by %s", ender_name)
             
             # Notify everyone in the room
             emit('call_ended', {
@@ -297,7 +460,7 @@ def handle_end_call(data):
             cleanup_room(room_id)
             
     except Exception as e:
-        logger.error(f"Error in end_call: {e}")
+        logger.error("Error in end_call: %s", e)
 
 
 # ==================== WEBRTC SIGNALING MESSAGES ====================
@@ -308,20 +471,23 @@ def handle_offer(data):
     Relay WebRTC offer from one peer to another.
     This contains the SDP (Session Description Protocol) data.
     """
-    try:
-        target_sid = data.get('target_sid')
-        offer = data.get('offer')
-        
-        if target_sid and target_sid in connected_users:
-            emit('offer', {
-                'offer': offer,
-                'sender_sid': request.sid,
-                'sender_name': connected_users[request.sid]['name']
-            }, room=target_sid)
-            logger.debug(f"Offer relayed from {request.sid} to {target_sid}")
-            
-    except Exception as e:
-        logger.error(f"Error in offer: {e}")
+    if not isinstance(data, dict):
+        return
+    
+    target_sid = data.get('target_sid')
+    offer = data.get('offer')
+    
+    sender_name = connected_users.get(request.sid)
+    if sender_name is None:
+        return
+    
+    if isinstance(target_sid, str) and target_sid in connected_users:
+        emit('offer', {
+            'offer': offer,
+            'sender_sid': request.sid,
+            'sender_name': sender_name
+        }, room=target_sid)
+        logger.debug("Offer relayed from %s to %s", request.sid, target_sid)
 
 
 @socketio.on('answer')
@@ -330,19 +496,18 @@ def handle_answer(data):
     Relay WebRTC answer from one peer to another.
     This is the response to an offer.
     """
-    try:
-        target_sid = data.get('target_sid')
-        answer = data.get('answer')
-        
-        if target_sid and target_sid in connected_users:
-            emit('answer', {
-                'answer': answer,
-                'sender_sid': request.sid
-            }, room=target_sid)
-            logger.debug(f"Answer relayed from {request.sid} to {target_sid}")
-            
-    except Exception as e:
-        logger.error(f"Error in answer: {e}")
+    if not isinstance(data, dict):
+        return
+    
+    target_sid = data.get('target_sid')
+    answer = data.get('answer')
+    
+    if isinstance(target_sid, str) and target_sid in connected_users:
+        emit('answer', {
+            'answer': answer,
+            'sender_sid': request.sid
+        }, room=target_sid)
+        logger.debug("Answer relayed from %s to %s", request.sid, target_sid)
 
 
 @socketio.on('ice_candidate')
@@ -350,20 +515,37 @@ def handle_ice_candidate(data):
     """
     Relay ICE (Interactive Connectivity Establishment) candidates.
     These help peers find the best network path to each other.
+    Candidates arrive in bursts, so they are queued per target and
+    relayed together as a single ice_candidate_batch event.
     """
-    try:
-        target_sid = data.get('target_sid')
-        candidate = data.get('candidate')
-        
-        if target_sid and target_sid in connected_users:
-            emit('ice_candidate', {
-                'candidate': candidate,
-                'sender_sid': request.sid
-            }, room=target_sid)
-            logger.debug(f"ICE candidate relayed from {request.sid} to {target_sid}")
-            
-    except Exception as e:
-        logger.error(f"Error in ice_candidate: {e}")
+    if not isinstance(data, dict):
+        return
+    
+    target_sid = data.get('target_sid')
+    candidate = data.get('candidate')
+    
+    if isinstance(target_sid, str) and target_sid in connected_users:
+        buffer = _ice_buffers[(request.sid, target_sid)]
+        if not buffer:
+            socketio.start_background_task(flush_ice_candidates, request.sid, target_sid)
+        buffer.append(candidate)
+        logger.debug("ICE candidate queued from %s to %s", request.sid, target_sid)
+
+
+def flush_ice_candidates(sender_sid, target_sid):
+    """
+    Wait for the batch window, then relay all candidates queued from
+    sender_sid to target_sid, naming the sender once for the whole batch.
+    """
+    socketio.sleep(ICE_BATCH_WINDOW)
+    
+    candidates = _ice_buffers.pop((sender_sid, target_sid), None)
+    if candidates:
+        socketio.emit('ice_candidate_batch', {
+            'sender_sid': sender_sid,
+            'candidates': candidates
+        }, room=target_sid)
+        logger.debug("Relayed %s ICE candidates to %s", len(candidates), target_sid)
 
 
 # ==================== CHAT MESSAGING ====================
@@ -373,41 +555,42 @@ def handle_send_message(data):
     """Handle text chat messages between users."""
     try:
         target_sid = data.get('target_sid')
-        message = data.get('message', '').strip()
+        # Check the raw length before stripping so huge messages are never scanned
+        message = data.get('message') or ''
+        if len(message) > 1024:
+            return
+        message = message.strip()
         
         if not message or len(message) > 1000:
             return
             
         sender_sid = request.sid
-        sender_name = connected_users.get(sender_sid, {}).get('name', 'Anonymous')
+        sender_name = connected_users.get(sender_sid)
+        if sender_name is None:
+            return
         
-        # If target is specified, send private message
+        # If target is specified, send private message to the target and
+        # echo it to the sender in one emit; the sender's client renders
+        # the "(to X)" label from target_sid
         if target_sid and target_sid in connected_users:
             emit('receive_message', {
                 'sender_sid': sender_sid,
                 'sender_name': sender_name,
+                'target_sid': target_sid,
                 'message': message,
                 'private': True
-            }, room=target_sid)
-            
-            # Also show to sender
-            emit('receive_message', {
-                'sender_sid': sender_sid,
-                'sender_name': f"{sender_name} (to {connected_users[target_sid]['name']})",
-                'message': message,
-                'private': True
-            }, room=sender_sid)
+            }, room=[target_sid, sender_sid])
         else:
-            # Broadcast to all (public message)
+            # Send to everyone in the lobby (public message)
             emit('receive_message', {
                 'sender_sid': sender_sid,
                 'sender_name': sender_name,
                 'message': message,
                 'private': False
-            }, broadcast=True)
+            }, room=LOBBY_ROOM)
             
     except Exception as e:
-        logger.error(f"Error in send_message: {e}")
+        logger.error("Error in send_message: %s", e)
 
 
 # ==================== UTILITY FUNCTIONS ====================
@@ -416,27 +599,31 @@ def cleanup_room(room_id):
     """Remove a room and make users leave it."""
     if room_id in active_rooms:
         users = active_rooms[room_id]
+        # Drop the Socket.IO room in one operation instead of per-user leave_room
+        close_room(room_id)
         for user_sid in users:
-            leave_room(room_id, sid=user_sid)
+            rooms = user_rooms.get(user_sid)
+            if rooms is not None:
+                rooms.discard(room_id)
+                if not rooms:
+                    del user_rooms[user_sid]
         del active_rooms[room_id]
-        logger.info(f"Room {room_id} cleaned up")
+        logger.info("Room %s cleaned up", room_id)
 
 
-def cleanup_user_rooms(sid):
-    """Clean up all rooms a user was part of."""
-    rooms_to_cleanup = []
-    for room_id, users in active_rooms.items():
-        if sid in users:
-            rooms_to_cleanup.append(room_id)
-    
-    for room_id in rooms_to_cleanup:
-        # Notify other user in the room
-        other_users = [u for u in active_rooms[room_id] if u != sid]
-        for other_sid in other_users:
-            emit('call_ended', {
-                'ender_name': connected_users.get(sid, {}).get('name', 'Someone'),
-                'reason': 'disconnected'
-            }, room=other_sid)
+def cleanup_user_rooms(sid, ender_name):
+    """
+    Clean up all rooms a user was part of.
+    ender_name is passed in because the user is already gone from connected_users.
+    """
+    for room_id in list(user_rooms.pop(sid, ())):
+        # Notify the other user in the room
+        first_sid, second_sid = active_rooms[room_id]
+        other_sid = second_sid if first_sid == sid else first_sid
+        emit('call_ended', {
+            'ender_name': ender_name,
+            'reason': 'disconnected'
+        }, room=other_sid)
         cleanup_room(room_id)
 
 
@@ -446,8 +633,8 @@ if __name__ == '__main__':
     # Get port from environment (Render sets this) or default to 5000
     port = int(os.environ.get('PORT', 5000))
     
-    logger.info(f"Starting Yumee Signaling Server on port {port}")
-    logger.info(f"WebSocket endpoint: ws://localhost:{port}/socket.io/")
+    logger.info("Starting Yumee Signaling Server on port %s", port)
+    logger.info("WebSocket endpoint: ws://localhost:%s/socket.io/", port)
     
     # Run the server locally (for development/testing)
     # On Render, gunicorn handles this